@@ -1,14 +1,21 @@
-import re
 import os
+import stat
 import click
+import queue
+import functools
+import collections
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
-from flac_cleaner.formats import AudioTags, Mp3, Flac
+from flac_cleaner.formats import AudioTags, FORMATS, match_clean_filename
 from flac_cleaner import __version__
 
 LOG = logging.getLogger(__name__)
 
+AUDIO_SUFFIXES = tuple(f'.{ext}' for ext in FORMATS)
+
 CONTEXT_SETTINGS = {
     'help_option_names': ['-h', '--help'],
 }
@@ -18,51 +25,306 @@ class PathFormatError(Exception):
     pass
 
 
+def audio_ext(filename):
+    """ Returns the extension of a supported audio filename, otherwise None
+    """
+    # Reject the common non-audio entry before splitting anything off
+    if not filename.endswith(AUDIO_SUFFIXES):
+        return None
+    return filename.rpartition('.')[2]
+
+
 def audio_file(path):
-    if os.path.isfile(path):
-        _, ext = os.path.splitext(path)
-        if ext in ('.mp3', '.flac'):
-            yield path
+    ext = audio_ext(os.path.basename(path))
+    if ext:
+        yield path, ext
 
 
-def discover_audio_files(path):
-    if os.path.isfile(path):
-        yield from audio_file(path)
+def scan_dir(path):
+    """ List a whole directory, returning its subdirectories and its audio
+        files as (path, ext). The listing is finished before the caller
+        sees any file, so files renamed by the caller can't turn up again
+        later in the same listing.
+    """
+    subdirs = []
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    ext = audio_ext(entry.name)
+                    if ext and entry.is_file():
+                        files.append((entry.path, ext))
+    except OSError as e:
+        LOG.error(f'Cannot scan {path!r}: {e}')
+
+    return subdirs, files
+
+
+def walk_audio_files(path):
+    subdirs, files = scan_dir(path)
+    yield from files
+    for subdir in subdirs:
+        yield from walk_audio_files(subdir)
+
+
+def parallel_walk_audio_files(path, threads):
+    """ Walk directories breadth-first from a pool of worker threads so
+        that slow (network) readdir calls overlap.
+    """
+    found = queue.Queue()
+    pending = [path]
+    busy = 0
+    running = threads
+    cond = threading.Condition()
+
+    def scan():
+        nonlocal busy
+        while True:
+            with cond:
+                while not pending and busy:
+                    cond.wait()
+                if not pending:
+                    return
+                top = pending.pop()
+                busy += 1
+
+            subdirs = []
+            try:
+                # Queue files only once the directory is fully listed,
+                # so a file renamed by a consumer can't be found twice
+                subdirs, files = scan_dir(top)
+                for found_file in files:
+                    found.put(found_file)
+            finally:
+                # Always release the directory, or the other workers
+                # would wait on it forever
+                with cond:
+                    pending.extend(subdirs)
+                    busy -= 1
+                    cond.notify_all()
+
+    def worker():
+        nonlocal running
+        try:
+            scan()
+        finally:
+            # The last worker out marks the end of the results
+            with cond:
+                running -= 1
+                if not running:
+                    found.put(None)
 
-    for root, _, paths in os.walk(path):
-        for filename in paths:
-            yield from audio_file(os.path.join(root, filename))
+    for _ in range(threads):
+        threading.Thread(target=worker, daemon=True).start()
 
+    yield from iter(found.get, None)
 
-def object_from_path(path):
-    if path.endswith('.flac'):
-        return Flac(path)
-    elif path.endswith('.mp3'):
-        return Mp3(path)
-    else:
+
+def discover_audio_files(path, threads=0):
+    # Resolve the root once; everything found below it is then absolute
+    path = os.path.abspath(path)
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+
+    if stat.S_ISREG(mode):
+        yield from audio_file(path)
+    elif stat.S_ISDIR(mode):
+        if threads > 1:
+            yield from parallel_walk_audio_files(path, threads)
+        else:
+            yield from walk_audio_files(path)
+
+
+def object_from_path(path, ext):
+    try:
+        cls = FORMATS[ext]
+    except KeyError:
         raise PathFormatError(f'Unsupported format {path!r}')
+    return cls(path)
 
 
-def discover_audio(path):
-    for path in discover_audio_files(path):
-        try:
-            yield object_from_path(path)
-        except PathFormatError:
-            LOG.error(path)
+def load_audio(path, ext):
+    try:
+        return object_from_path(path, ext)
+    except PathFormatError:
+        LOG.error(path)
+
+
+def process_audio_files(func, path, jobs=0):
+    """ Yield func(path, ext) for each audio file found under path, in
+        discovery order. When jobs > 1 it is the total thread budget:
+        jobs // 2 threads scan directories (a single scanner being the
+        calling thread) and the rest process files, overlapping their I/O.
+    """
+    if jobs <= 1:
+        for found in discover_audio_files(path):
+            yield func(*found)
+        return
+
+    # Split the thread budget between scanning and processing
+    scanners = jobs // 2
+    workers = jobs - scanners
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded window of files in flight so that results
+        # stream out in order without queueing up the whole library
+        futures = collections.deque()
+        for found in discover_audio_files(path, scanners):
+            if len(futures) >= 2 * workers:
+                yield futures.popleft().result()
+            futures.append(executor.submit(func, *found))
+
+        while futures:
+            yield futures.popleft().result()
+
+
+def process_audio(func, path, jobs=0):
+    """ As process_audio_files, but loads each file and calls func(obj)
+    """
+    def process(path, ext):
+        obj = load_audio(path, ext)
+        return func(obj) if obj is not None else None
+
+    yield from process_audio_files(process, path, jobs)
+
+
+def read_tags(path, ext):
+    tags = FORMATS[ext].read_tags(path)
+    return tags.pprint() if tags is not None else None
+
+
+def tag_changes(file_tags, tags, current_tags):
+    """ Compare the values of tags now held in file_tags with those in
+        current_tags and return lists of added, removed and changed tags.
+    """
+    added_tags = []
+    removed_tags = []
+    changed_tags = []
+    for tag in tags:
+        current = current_tags.get(tag)
+        new = file_tags[tag] if tag in file_tags else None
+        if current is None:
+            if new is not None:
+                added_tags.append(tag)
+        elif new is None:
+            removed_tags.append(tag)
+        elif current != new:
+            changed_tags.append(f'{tag}: {current[0]!r} -> {new[0]!r}')
+
+    return added_tags, removed_tags, changed_tags
+
+
+def tag_change_messages(added_tags, removed_tags, changed_tags):
+    messages = []
+    if added_tags:
+        messages.append(f'New tags {", ".join(added_tags)!r}')
+
+    if removed_tags:
+        messages.append(f'Removed tags {", ".join(removed_tags)!r}')
+
+    for tag in changed_tags:
+        messages.append(f'Changed tag {tag!r}')
+
+    return messages
+
+
+def existing_artist(obj):
+    assert obj.artist, f'{obj.path!r}: Artist not defined anywhere'
+    return obj.artist
+
+
+def clean_file(obj, dry_run, artist, album, year, disc, clear):
+    # Everything reported for a file goes out as one single-line log
+    # record, so it all carries the formatter's prefix
+    log_changes = LOG.isEnabledFor(logging.INFO)
+    messages = []
+
+    clean_path = obj.clean_path
+    if clean_path != obj.path:
+        if log_changes:
+            messages.append(f'Renaming {obj.path!r} to {clean_path!r}')
+
+        if not dry_run:
+            obj.rename(clean_path)
+
+    tags = {
+        'tracknumber': obj.tracknumber,
+        'title': obj.title,
+        'artist': artist or existing_artist(obj),
+    }
+    tags.update(
+        (tag, value) for tag, value in (
+            ('album', album or obj.album),
+            ('date', year),
+            ('discnumber', disc),
+        ) if value
+    )
+
+    # Existing values are all discarded anyway when clearing
+    current_tags = {}
+    if not clear:
+        file_tags = obj.tags
+        current_tags = {t: file_tags[t] for t in tags if t in file_tags}
+
+    if clear:
+        obj.clear()
+
+    obj.set_tags(tags)
+
+    # Clearing always needs a save, so only diff then for the log
+    changes = None
+    if log_changes or not clear:
+        changes = tag_changes(obj.tags, tags, current_tags)
+
+    if log_changes:
+        messages.extend(tag_change_messages(*changes))
+        if messages:
+            LOG.info('; '.join(messages))
+
+    if dry_run:
+        return
+
+    # Renaming doesn't touch the file contents, so a file whose
+    # tags are already correct needn't be rewritten
+    if clear or any(changes):
+        obj.save()
+
+
+def verify_file(path, ext, tags, full):
+    if not match_clean_filename(os.path.basename(path)):
+        LOG.error(f'Bad file path {path!r}')
+        return
+
+    if full:
+        obj = object_from_path(path, ext)
+        obj.verify(tags=tags)
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.option('-n', '--dry-run', is_flag=True, help="Dry run")
 @click.version_option(version=__version__, message=f'v{__version__}')
 @click.option('--padding', default=2, show_default=True, help="Track padding")
+@click.option(
+    '-j',
+    '--jobs',
+    default=0,
+    show_default=True,
+    help="Total threads, split evenly between scanning directories and "
+         "processing files (for slow disks)"
+)
 @click.pass_context
-def main(ctx, dry_run, padding) -> None:
+def main(ctx, dry_run, padding, jobs) -> None:
     """ Manage flac tags, inspect or fix.
     """
     noop = '[DRY RUN] ' if dry_run else ''
     formatter = f'%(asctime)s - %(levelname)s - {noop}%(message)s'
     logging.basicConfig(level=logging.INFO, format=formatter)
-    ctx.obj = {'dry_run': dry_run}
+    ctx.obj = {'dry_run': dry_run, 'jobs': jobs}
     AudioTags.PADDING = padding
 
 
@@ -78,66 +340,17 @@ def clean(ctx, dir, artist, album, year, disc, clear):
     """ Ensure filename conforms to "<tracknumber> - <title>.flac"
         Adds tags where missing.
     """
-    dry_run = ctx.obj['dry_run']
-
-    tags = {}
-
-    for obj in discover_audio(dir):
-
-        if obj.clean_path != obj.path:
-            LOG.info(f'Renaming {obj.path!r} to {obj.clean_path!r}')
-
-            if not dry_run:
-                obj.rename(obj.clean_path)
-
-        tags['tracknumber'] = obj.tracknumber
-        tags['title'] = obj.title
-
-        if artist:
-            tags['artist'] = artist
-        else:
-            assert obj.artist, f'{obj.path!r}: Artist not defined anywhere'
-            tags['artist'] = obj.artist
-
-        if album:
-            tags['album'] = album
-        elif obj.album:
-            tags['album'] = obj.album
-
-        if year:
-            tags['date'] = year
-
-        if disc:
-            tags['discnumber'] = disc
-
-        current_tags = {t: obj.tags.get(t)[0] for t in tags if t in obj.tags}
-
-        if clear:
-            obj.clear()
-
-        obj.set_tags(tags)
-
-        new_tags = {t: obj.tags.get(t)[0] for t in tags if t in obj.tags}
-
-        added_tags = new_tags.keys() - current_tags.keys()
-        if added_tags:
-            LOG.info(f'New tags {", ".join(added_tags)!r}')
-
-        removed_tags = current_tags.keys() - new_tags.keys()
-        if removed_tags:
-            LOG.info(f'Removed tags {", ".join(removed_tags)!r}')
-
-        common_tags = current_tags.keys() & new_tags.keys()
-        changed_tags = {
-            f'{tag}: {current_tags[tag]!r} -> {new_tags[tag]!r}'
-            for tag in common_tags if current_tags[tag] != new_tags[tag]
-        }
-
-        for tag in changed_tags:
-            LOG.info(f'Changed tag {tag!r}')
-
-        if not dry_run:
-            obj.save()
+    process = functools.partial(
+        clean_file,
+        dry_run=ctx.obj['dry_run'],
+        artist=artist,
+        album=album,
+        year=year,
+        disc=disc,
+        clear=clear,
+    )
+    for _ in process_audio(process, dir, ctx.obj['jobs']):
+        pass
 
 
 @main.command()
@@ -150,7 +363,8 @@ def clean(ctx, dir, artist, album, year, disc, clear):
     show_default=True, help="Expected tags"
 )
 @click.option('-f', '--full', is_flag=True, help="Full verify (inc tags)")
-def verify(dir, tags, full):
+@click.pass_context
+def verify(ctx, dir, tags, full):
     """ Scan a directory recursively and report filenames that
         do not conform or do not contain tags:
             - artist
@@ -158,22 +372,28 @@ def verify(dir, tags, full):
             - title
             - tracknumber
     """
-    regex = re.compile(r'^(\d+) - (.*)\.(flac|mp3)$')
-
-    for path in discover_audio_files(dir):
-        if not regex.match(os.path.basename(path)):
-            LOG.error(f'Bad file path {path!r}')
-            continue
-
-        if full:
-            obj = AudioTags.object_from_path(path)
-            obj.verify(tags=tags)
+    process = functools.partial(verify_file, tags=tags, full=full)
+    for _ in process_audio_files(process, dir, ctx.obj['jobs']):
+        pass
 
 
 @main.command()
 @click.argument('dir')
-def tags(dir):
+@click.option(
+    '-q',
+    '--quick',
+    is_flag=True,
+    help="Only read the tags, skipping audio properties"
+)
+@click.pass_context
+def tags(ctx, dir, quick):
     """ Print tags for each flac file discovered
     """
-    for obj in discover_audio(dir):
-        click.echo(obj)
+    if quick:
+        texts = process_audio_files(read_tags, dir, ctx.obj['jobs'])
+    else:
+        texts = process_audio(str, dir, ctx.obj['jobs'])
+
+    for text in texts:
+        if text is not None:
+            click.echo(text)
@@ -1,29 +1,63 @@
 from abc import ABC, abstractmethod
-import re
 import os
 import logging
-from mutagen.flac import FLAC
+from mutagen.flac import FLAC, VCFLACDict
 from mutagen.mp3 import MP3
 from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3NoHeaderError
 
 LOG = logging.getLogger(__name__)
 
+def parse_filename(filename):
+    """ Loosely split "<tracknumber>[-. ]<title>.<ext>" into its parts.
+        Returns (tracknumber, title, ext) or None if it doesn't match.
+    """
+    base, _, ext = filename.rpartition('.')
+    if ext not in EXTENSIONS:
+        return None
+
+    # Same digits as str.isdecimal() in match_clean_filename
+    digits = 0
+    for char in base:
+        if not char.isdecimal():
+            break
+        digits += 1
+
+    rest = base[digits:]
+    title = rest.lstrip('-. ')
+    if not digits or len(title) == len(rest):
+        return None
+
+    return base[:digits], title, ext
+
+
+def match_clean_filename(filename):
+    """ Returns the extension if filename is exactly
+        "<tracknumber> - <title>.<ext>", otherwise None.
+    """
+    base, _, ext = filename.rpartition('.')
+    if ext not in EXTENSIONS:
+        return None
+
+    tracknumber, sep, _ = base.partition(' - ')
+    return ext if sep and tracknumber.isdecimal() else None
+
 
 class AudioTags(ABC):
-    REGEX = re.compile(r'^(\d+)[-. ]+(.*)\.(?:flac|mp3)$')
     ALL_TAGS = ['artist', 'album', 'title', 'tracknumber']
     PADDING = 2
 
     def __init__(self, path):
         self._tracknumber = None
         self._title = None
-        match = self.REGEX.match(os.path.basename(path))
-        if match:
-            tracknumber, self._title = match.groups()
+        self._dirname, self._filename = os.path.split(path)
+        parts = parse_filename(self._filename)
+        if parts:
+            tracknumber, self._title, _ = parts
             self._tracknumber = f'{int(tracknumber):0{self.PADDING}d}'
 
     def verify(self, tags):
-        if not self.PATH_REGEX.match(self.filename):
+        if not match_clean_filename(self.filename):
             LOG.error(f'Bad file format {self.path!r}')
 
         missing_tags = set(tags) - set(self.obj.keys())
@@ -36,6 +70,13 @@ class AudioTags(ABC):
     def load(self, path):
         pass
 
+    @classmethod
+    @abstractmethod
+    def read_tags(cls, path):
+        """ Read just the tags from path, skipping the audio properties.
+            Returns None if the file has no tags.
+        """
+
     @property
     def title(self):
         return self._title
@@ -54,11 +95,11 @@ class AudioTags(ABC):
 
     @property
     def filename(self):
-        return os.path.basename(self.obj.filename)
+        return self._filename
 
     @property
     def dirname(self):
-        return os.path.dirname(self.obj.filename)
+        return self._dirname
 
     @property
     def clean_filename(self):
@@ -77,27 +118,57 @@ class AudioTags(ABC):
     def set_tags(self, tags):
         self.obj.tags.update(self.transform_tags(tags))
 
+    def clear(self):
+        self.obj.tags.clear()
+
     def save(self) -> None:
         self.obj.save()
 
     def rename(self, path):
         os.rename(self.path, path)
-        self.obj = self.load(path)
+        # Contents are unchanged, so point mutagen at the new name
+        # rather than parsing the file again
+        self.obj.filename = path
+        self._dirname, self._filename = os.path.split(path)
 
 
 class Flac(AudioTags):
     EXT = 'flac'
-    PATH_REGEX = re.compile(r'^(\d+) - (.*)\.flac$')
+    # Vorbis comment names for the tags we write, computed once
+    TAG_NAMES = {
+        t: t.upper() for t in AudioTags.ALL_TAGS + ['date', 'discnumber']
+    }
 
     def __init__(self, path):
         super(Flac, self).__init__(path)
         self.obj = self.load(path)
 
     def load(self, path):
-        return FLAC(os.path.abspath(path))
+        return FLAC(path)
+
+    @classmethod
+    def read_tags(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(4) != b'fLaC':
+                # Possibly behind an ID3 header; let mutagen deal with it
+                return FLAC(path).tags
+
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    return None
+
+                size = int.from_bytes(header[1:], 'big')
+                if header[0] & 0x7f == VCFLACDict.code:
+                    return VCFLACDict(f.read(size))
+                if header[0] & 0x80:
+                    # Last metadata block
+                    return None
+                f.seek(size, os.SEEK_CUR)
 
     def transform_tags(self, tags):
-        return {k.upper(): v for k, v in tags.items()}
+        names = self.TAG_NAMES
+        return {names.get(k) or k.upper(): v for k, v in tags.items()}
 
     @property
     def artist(self):
@@ -110,22 +181,25 @@ class Flac(AudioTags):
 
 class Mp3(AudioTags):
     EXT = 'mp3'
-    PATH_REGEX = re.compile(r'^(\d+) - (.*)\.mp3$')
 
     def __init__(self, path):
         super(Mp3, self).__init__(path)
         self.obj = self.load(path)
 
     def load(self, path):
-        return MP3(os.path.abspath(path), ID3=EasyID3)
+        return MP3(path, ID3=EasyID3)
+
+    @classmethod
+    def read_tags(cls, path):
+        try:
+            return EasyID3(path)
+        except ID3NoHeaderError:
+            return None
 
     def clear(self):
-        # Need to clear all ID3 tags and reload
-        mp3 = MP3(self.path)
-        mp3.clear()
-        mp3.save()
-        self.obj = MP3(self.path, ID3=EasyID3)
-        self.obj.clear()
+        # EasyID3 only clears the frames it knows about, so swap in an
+        # empty tag which replaces every ID3 frame on the next save
+        self.obj.tags = EasyID3()
 
     @property
     def title(self):
@@ -138,3 +212,7 @@ class Mp3(AudioTags):
     @property
     def album(self):
         return self.obj.tags['album'][0] if 'album' in self.tags else None
+
+
+FORMATS = {cls.EXT: cls for cls in (Flac, Mp3)}
+EXTENSIONS = tuple(FORMATS)
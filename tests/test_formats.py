@@ -0,0 +1,90 @@
+import pytest
+from mutagen.flac import FLAC, Picture, VCFLACDict
+
+from flac_cleaner.formats import Flac, parse_filename, match_clean_filename
+
+STREAMINFO = 0
+PADDING = 1
+PICTURE = 6
+
+
+def write_flac(path, blocks):
+    """ Write a FLAC file holding just the given (code, data) metadata
+        blocks, after a minimal STREAMINFO.
+    """
+    info = (44100 << 44) | (1 << 41) | (15 << 36) | 44100
+    streaminfo = bytes(10) + info.to_bytes(8, 'big') + bytes(16)
+    blocks = [(STREAMINFO, streaminfo)] + blocks
+
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        for i, (code, data) in enumerate(blocks):
+            last = 0x80 if i == len(blocks) - 1 else 0
+            f.write(bytes([last | code]) + len(data).to_bytes(3, 'big'))
+            f.write(data)
+
+
+def vorbis_comment(**tags):
+    comment = VCFLACDict()
+    for key, value in tags.items():
+        comment[key] = value
+    return comment.write()
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('01 - x.flac', ('01', 'x', 'flac')),
+    ('01. x.flac', ('01', 'x', 'flac')),
+    ('01..flac', ('01', '', 'flac')),
+    ('01.flac', None),
+    ('123abc.flac', None),
+    ('3 Track.mp3', ('3', 'Track', 'mp3')),
+    ('01 - x.ogg', None),
+    ('٠١ - x.flac', ('٠١', 'x', 'flac')),
+])
+def test_parse_filename(filename, expected):
+    assert parse_filename(filename) == expected
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('01 - x.flac', 'flac'),
+    ('01 - x.mp3', 'mp3'),
+    ('01. x.flac', None),
+    ('01..flac', None),
+    ('01.flac', None),
+    ('123abc.flac', None),
+    ('01 - x.ogg', None),
+    ('٠١ - x.flac', 'flac'),
+])
+def test_match_clean_filename(filename, expected):
+    assert match_clean_filename(filename) == expected
+
+
+@pytest.mark.parametrize('filename', ['01 - x.flac', '٠١ - x.mp3'])
+def test_clean_filename_parses(filename):
+    # Anything verify accepts, clean must be able to parse
+    assert match_clean_filename(filename)
+    assert parse_filename(filename)
+
+
+def test_flac_read_tags_skips_other_blocks(tmp_path):
+    path = str(tmp_path / '01 - x.flac')
+    picture = Picture()
+    picture.data = b'image'
+    write_flac(path, [
+        (PADDING, bytes(100)),
+        (PICTURE, picture.write()),
+        (VCFLACDict.code, vorbis_comment(artist='Band', title='x')),
+        (PADDING, bytes(10)),
+    ])
+
+    tags = Flac.read_tags(path)
+    assert tags['artist'] == ['Band']
+    assert tags['title'] == ['x']
+    assert tags.pprint() == FLAC(path).tags.pprint()
+
+
+def test_flac_read_tags_without_comment(tmp_path):
+    path = str(tmp_path / '01 - x.flac')
+    write_flac(path, [(PADDING, bytes(100))])
+
+    assert Flac.read_tags(path) is None